@@ -12,6 +12,7 @@ def build_executable():
         "--windowed",
         "--icon=assets/MedicalDocsAnalyzer.ico",
         "--add-data", "config.ini:.",
+        "--collect-all", "fastexcel",  # polarsのcalamine読み込みは文字列でfastexcelをimportするため明示的に同梱する
         "main.py"
     ])
 
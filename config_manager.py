@@ -1,6 +1,8 @@
 import configparser
 import os
+import re
 import sys
+from functools import lru_cache
 from typing import Any
 
 
@@ -16,12 +18,40 @@ def get_config_path():
 
 CONFIG_PATH = get_config_path()
 
+# 一覧形式の設定値（担当者名・診療科）の区切り
+LIST_SEPARATOR = re.compile(r'\s*,\s*')
+
+# [DEFAULT]も通常のセクションとして読み込むための、実在しないセクション名
+RAW_DEFAULT_SECTION = '\0'
+
+# 設定ファイルのパスごとに ファイルの内容 と解析済みの内容（セクションごとの生の値）を保持する
+_config_cache = {}
+
+
+def _parse_config_text(text: str) -> dict:
+    # 各セクションには自身の値だけを持たせ、[DEFAULT]の値は[DEFAULT]にだけ残す
+    parser = configparser.RawConfigParser(default_section=RAW_DEFAULT_SECTION)
+    parser.read_string(text, source=CONFIG_PATH)
+    return {section: dict(parser[section]) for section in parser.sections()}
+
+
+def _read_config_file(config: configparser.ConfigParser):
+    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+        text = f.read()
+
+    # 内容が前回と同じであれば解析済みの内容から復元する
+    cached = _config_cache.get(CONFIG_PATH)
+    if cached is None or cached[0] != text:
+        cached = (text, _parse_config_text(text))
+        _config_cache[CONFIG_PATH] = cached
+
+    config.read_dict(cached[1])
+
 
 def load_config() -> configparser.ConfigParser:
     config = configparser.ConfigParser()
     try:
-        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-            config.read_file(f)
+        _read_config_file(config)
 
         if 'Analysis' not in config:
             config['Analysis'] = {}
@@ -41,11 +71,18 @@ def load_config() -> configparser.ConfigParser:
     return config
 
 
+@lru_cache(maxsize=32)
+def _split_config_list(value: str) -> tuple:
+    # カンマ区切りの設定値を一度だけ分解し、同じ文字列オブジェクトを使い回す
+    return tuple(sys.intern(item) for item in LIST_SEPARATOR.split(value.strip()) if item)
+
+
 def get_ordered_names(config):
-    ordered_names_str = config['Analysis'].get('ordered_names', "")
-    if ordered_names_str:
-        return [name.strip() for name in ordered_names_str.split(',')]
-    return []
+    return list(_split_config_list(config['Analysis'].get('ordered_names', "")))
+
+
+def get_clinical_departments(config):
+    return list(_split_config_list(config['Analysis'].get('clinical_departments', "")))
 
 
 def save_config(config: configparser.ConfigParser):
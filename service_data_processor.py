@@ -1,54 +1,61 @@
 import datetime
+from functools import lru_cache
 
 import polars as pl
 
 
-def process_cell_value(cell):
-    if cell is None:
-        return None
+# calamineで文字列として読み込んだ日時セルの形式（例: 2025-01-10 00:00:00）
+DATETIME_CELL_PATTERN = r"^(\d{4})-(\d{2})-(\d{2}) \d{2}:\d{2}:\d{2}(?:\.\d+)?$"
 
-    if not hasattr(cell, 'column'):
-        return None
 
-    if cell.column == 1 and cell.value:  # A列（預り日）
-        if isinstance(cell.value, (datetime.datetime, datetime.date)):
-            # 日付オブジェクトを文字列に変換
-            return cell.value.strftime('%Y/%m/%d')
-        return cell.value
-    elif cell.column == 2 and cell.value:  # B列（患者ID）
-        # 患者IDを数値として処理
-        try:
-            if isinstance(cell.value, str):
-                # 文字列の場合は数値に変換
-                return int(cell.value)
-            return cell.value
-        except (ValueError, TypeError):
-            # 数値変換できない場合は元の値を使用
-            return cell.value
-    elif cell.column == 8 and cell.value:  # H列（医師依頼日）
-        if isinstance(cell.value, (datetime.datetime, datetime.date)):
-            # 日付オブジェクトを文字列に変換
-            return cell.value.strftime('%Y/%m/%d')
-        return cell.value
+def process_column_values(df):
+    if df is None or df.height == 0:
+        return df
+
+    columns = df.columns
+    expressions = []
+
+    # A列（預り日）、H列（医師依頼日）: 日時セルをYYYY/MM/DD形式の文字列に変換
+    for col_idx in (0, 7):
+        if col_idx < len(columns):
+            expressions.append(
+                pl.col(columns[col_idx]).str.replace(DATETIME_CELL_PATTERN, "${1}/${2}/${3}")
+            )
+
+    # B列（患者ID）: 数値として解釈できる値は数値表記に揃え、それ以外は元の値を使用
+    if len(columns) > 1:
+        patient_id = pl.col(columns[1])
+        expressions.append(
+            pl.coalesce(
+                patient_id.str.strip_chars().cast(pl.Int64, strict=False).cast(pl.Utf8),
+                patient_id
+            ).alias(columns[1])
+        )
+
+    return df.with_columns(expressions)
+
+
+@lru_cache(maxsize=4096)
+def _format_date_text(value):
+    # 日付部分のみを抽出（YYYY-MM-DD または YYYY/MM/DD 形式）
+    date_parts = value.split()[0] if ' ' in value else value
+
+    # 年月日の区切りを"/"に統一
+    if '-' in date_parts:
+        parts = date_parts.split('-')
+        if len(parts) == 3:
+            year, month, day = parts
+            return f"{year}/{month}/{day}"
+        else:
+            return date_parts
     else:
-        return cell.value
+        return date_parts
 
 
 def format_date_string(value):
+    # 台帳では同じ日付が繰り返し現れるため、文字列ごとの変換結果をキャッシュする
     if isinstance(value, str) and value:
-        # 日付部分のみを抽出（YYYY-MM-DD または YYYY/MM/DD 形式）
-        date_parts = value.split()[0] if ' ' in value else value
-
-        # 年月日の区切りを"/"に統一
-        if '-' in date_parts:
-            parts = date_parts.split('-')
-            if len(parts) == 3:
-                year, month, day = parts
-                return f"{year}/{month}/{day}"
-            else:
-                return date_parts
-        else:
-            return date_parts
+        return _format_date_text(value)
     return value
 
 
@@ -70,7 +77,8 @@ def format_output_cell_value(col_idx, value):
         return value
 
 
-def parse_date_to_formats(date_value):
+@lru_cache(maxsize=1024)
+def _parse_date_to_formats_cached(date_value):
     if date_value is None:
         return {
             'raw': None,
@@ -107,6 +115,11 @@ def parse_date_to_formats(date_value):
     }
 
 
+def parse_date_to_formats(date_value):
+    # キャッシュ済みの辞書が呼び出し側で変更されないよう複製して返す
+    return dict(_parse_date_to_formats_cached(date_value))
+
+
 def filter_dataframe_by_date_range(df, start_date_str=None, end_date_str=None):
     # データフレームが空の場合は早期リターン
     if df is None or len(df.columns) == 0 or df.height == 0:
@@ -126,42 +139,30 @@ def filter_dataframe_by_date_range(df, start_date_str=None, end_date_str=None):
             'file_date_range': 'no_data'
         }
 
-    # 日付列の前処理
-    df = df.with_columns(
-        pl.when(pl.col('預り日').is_not_null())
-        .then(pl.col('預り日'))
-        .otherwise(None)
-        .alias('預り日')
+    # 預り日を日付型として解釈する式（区切りは"/"・"-"のどちらも許容し、解釈できない値はnull）
+    received_date = (
+        pl.col('預り日').cast(pl.Utf8).str.replace_all('-', '/')
+        .str.extract(r'^(\d{4}/\d{1,2}/\d{1,2})')
+        .str.to_date('%Y/%m/%d', strict=False)
     )
 
     if start_date_str and end_date_str:
         try:
-            # 日付形式を統一
-            start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d')
-            end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d')
-
-            df = df.with_columns([
-                pl.when(pl.col('預り日').cast(pl.Utf8).str.contains('-'))
-                .then(pl.col('預り日').cast(pl.Utf8).str.replace('-', '/'))
-                .otherwise(pl.col('預り日'))
-                .alias('預り日')
-            ])
+            start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d').date()
+            end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d').date()
 
             # 日付範囲でフィルタリング
-            df = df.filter(
-                (pl.col('預り日') >= start_date.strftime('%Y/%m/%d')) &
-                (pl.col('預り日') <= end_date.strftime('%Y/%m/%d'))
-            )
+            df = df.filter(received_date.is_between(start_date, end_date))
         except (ValueError, TypeError) as e:
             print(f"日付フィルタリング中にエラーが発生: {e}")
 
     # 有効な日付を抽出
     try:
-        valid_dates = df.filter(pl.col('預り日').is_not_null()).select('預り日')
+        valid_dates = df.select(received_date.alias('預り日')).drop_nulls()
 
         if valid_dates.height > 0:
-            min_date = valid_dates.select(pl.col('預り日').min()).item()
-            max_date = valid_dates.select(pl.col('預り日').max()).item()
+            min_date = valid_dates['預り日'].min()
+            max_date = valid_dates['預り日'].max()
 
             # 日付フォーマットを処理
             min_date_formats = parse_date_to_formats(min_date)
@@ -185,13 +186,12 @@ def filter_dataframe_by_date_range(df, start_date_str=None, end_date_str=None):
 
 
 def clean_and_standardize_dataframe(df):
-    if df is None or len(df.columns) == 0:
+    if df is None:
         return pl.DataFrame()
 
-    # すべての列を文字列型に、空のセルを空文字に変換して処理
-    for col in df.columns:
-        df = df.with_columns([
-            pl.col(col).cast(pl.Utf8).fill_null("").alias(col)
-        ])
+    if isinstance(df, pl.DataFrame) and len(df.columns) == 0:
+        return pl.DataFrame()
 
-    return df
+    # すべての列を文字列型に、空のセルを空文字に変換して処理
+    # LazyFrameの場合は式を積むだけで、collectは呼び出し側で行う
+    return df.with_columns(pl.all().cast(pl.Utf8).fill_null(""))
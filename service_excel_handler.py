@@ -1,24 +1,52 @@
 import os
 import shutil
+import zipfile
 from pathlib import Path
-import datetime
+from xml.etree import ElementTree
 
 import openpyxl
 from openpyxl.styles import Alignment
 import polars as pl
+import xlsxwriter
+
+# セルの配置の種類（中央揃え、左揃え＋縮小して全体を表示）
+CENTER = 'center'
+LEFT_SHRINK = 'left_shrink'
+
+# 既存ファイル（openpyxl）用の配置。全セルで同じオブジェクトを共有し、罫線・フォント・塗りつぶしは変更しない
+CENTER_ALIGNMENT = Alignment(horizontal='center', vertical='center')
+LEFT_SHRINK_ALIGNMENT = Alignment(horizontal='left', vertical='center', shrink_to_fit=True)
+
+CELL_ALIGNMENTS = {
+    CENTER: CENTER_ALIGNMENT,
+    LEFT_SHRINK: LEFT_SHRINK_ALIGNMENT,
+}
+
+# 新規ファイル（XlsxWriter）用の同じ配置の書式
+CELL_FORMAT_PROPERTIES = {
+    CENTER: {'align': 'center', 'valign': 'vcenter'},
+    LEFT_SHRINK: {'align': 'left', 'valign': 'vcenter', 'shrink': True},
+}
+
+# A列からI列までの配置（A, B, E, F, G, H列は中央揃え、C, D, I列は左揃え）
+COLUMN_ALIGNMENT_KINDS = {
+    col: LEFT_SHRINK if col in [3, 4, 9] else CENTER
+    for col in range(1, 10)
+}
+
+WORKBOOK_XML_PATH = 'xl/workbook.xml'
 
 
 def backup_excel_file(file_path, backup_dir):
     try:
         backup_dir_path = Path(backup_dir)
-        if not backup_dir_path.exists():
-            backup_dir_path.mkdir(parents=True, exist_ok=True)
+        backup_dir_path.mkdir(parents=True, exist_ok=True)
 
         file_name = Path(file_path).name
         backup_file_name = f"backup_{file_name}"
         backup_path = backup_dir_path / backup_file_name
 
-        shutil.copy2(file_path, backup_path)
+        shutil.copyfile(file_path, backup_path)
         return str(backup_path)
     except Exception as e:
         print(f"バックアップ作成中にエラーが発生しました: {str(e)}")
@@ -26,87 +54,140 @@ def backup_excel_file(file_path, backup_dir):
 
 
 def get_last_row(worksheet):
-    last_row = 0
-    for row in worksheet.iter_rows():
-        if all(cell.value is None for cell in row):
+    # max_rowから上方向に、A-I列がすべて空の末尾行だけを読み飛ばす
+    last_row = worksheet.max_row
+    while last_row > 0:
+        row_values = next(worksheet.iter_rows(min_row=last_row, max_row=last_row, max_col=9, values_only=True))
+        if any(value is not None for value in row_values):
             break
-        last_row += 1
+        last_row -= 1
     return last_row
 
 
 def apply_cell_formats(worksheet, start_row):
     last_row = get_last_row(worksheet)
+    column_alignments = [(col, CELL_ALIGNMENTS[kind]) for col, kind in COLUMN_ALIGNMENT_KINDS.items()]
 
-    # A列からI列までの範囲を設定
+    # A列からI列までの範囲を設定（配置のみ変更し、既存の書式は保持）
     for row in range(start_row, last_row + 1):
-        for col in range(1, 10):
-            cell = worksheet.cell(row=row, column=col)
-            cell.alignment = Alignment(vertical='center')
+        for col, alignment in column_alignments:
+            worksheet.cell(row=row, column=col).alignment = alignment
 
-            if col in [1, 2, 5, 6, 7, 8]:  # A, B, E, F, H列
-                cell.alignment = Alignment(horizontal='center', vertical='center')
 
-            elif col in [3, 4, 9]:  # C, D, I列
-                cell.alignment = Alignment(horizontal='left', vertical='center', shrink_to_fit=True)
+def sort_dataframe_rows(df):
+    columns = df.columns
+    sort_keys = []
 
+    if len(columns) > 0:  # 預り日（区切りを"/"に揃えて比較）
+        sort_keys.append(pl.col(columns[0]).cast(pl.Utf8).fill_null("").str.replace_all("-", "/"))
+    if len(columns) > 4:  # 診療科
+        sort_keys.append(pl.col(columns[4]).cast(pl.Utf8).fill_null(""))
+    if len(columns) > 1:  # 患者ID（数値として比較）
+        sort_keys.append(
+            pl.col(columns[1]).cast(pl.Utf8).str.strip_chars().cast(pl.Int64, strict=False).fill_null(0)
+        )
 
-def sort_worksheet_data(worksheet):
-    data_rows = list(worksheet.iter_rows(min_row=2, values_only=True))
+    if not sort_keys:
+        return df
 
-    if not data_rows:
-        return
+    return df.sort(sort_keys, maintain_order=True)
 
-    sorted_rows = sorted(data_rows, key=lambda x: (
-        x[0] or datetime.datetime.min if isinstance(x[0], datetime.datetime) else str(x[0] or ""),  # 預り日
-        x[4] or "",  # 診療科
-        x[1] or 0  # 患者ID
-    ))
 
-    # 並べ替え後のデータを書き込み
-    for i, row_data in enumerate(sorted_rows, start=2):
-        for j, value in enumerate(row_data, start=1):
-            worksheet.cell(row=i, column=j).value = value
+def get_active_sheet_name(file_path):
+    # xl/workbook.xml のシート一覧と workbookView/@activeTab だけを読み、共有文字列やスタイルは解析しない
+    with zipfile.ZipFile(file_path) as archive:
+        root = ElementTree.fromstring(archive.read(WORKBOOK_XML_PATH))
 
+    active_tab = None
+    sheet_names = []
+    for element in root.iter():
+        tag = element.tag.rsplit('}', 1)[-1]  # 名前空間を除いた要素名
+        if tag == 'workbookView' and active_tab is None:
+            active_tab = int(element.get('activeTab', 0))
+        elif tag == 'sheet':
+            sheet_names.append(element.get('name'))
 
-def read_excel_to_dataframe(file_path, process_cell_func=None):
-    try:
-        workbook = openpyxl.load_workbook(file_path, read_only=True)
-        sheet = workbook.active
-
-        headers = [cell.value for cell in sheet[1][0:9] if cell.value is not None]  # A-I列
-
-        data = []
-        for row in sheet.iter_rows(min_row=2, max_col=9):
-            if process_cell_func:
-                processed_row = [process_cell_func(cell) for cell in row]
-            else:
-                processed_row = [cell.value for cell in row]
-            data.append(processed_row)
+    active_tab = active_tab or 0
+    return sheet_names[active_tab] if active_tab < len(sheet_names) else sheet_names[0]
 
-        schema = {header: pl.Utf8 for header in headers}
 
-        return pl.DataFrame(data, schema=schema, orient="row"), headers
+def read_excel_to_dataframe(file_path):
+    try:
+        try:
+            sheet_options = {"sheet_name": get_active_sheet_name(file_path)}
+        except Exception as e:
+            # ブック情報からアクティブシートを特定できない場合は先頭のシートを読み込む
+            print(f"アクティブシートを特定できないため先頭のシートを読み込みます: {str(e)}")
+            sheet_options = {"sheet_id": 1}
+        try:
+            # calamineでシート全体を文字列として一括で読み込む
+            df = pl.read_excel(file_path, **sheet_options, engine="calamine", infer_schema_length=0)
+        except Exception as e:
+            # calamineで解析できないファイルはopenpyxlで読み直す（読み取り専用モードでメモリ使用量を抑える）
+            print(f"calamineでの読み込みに失敗したためopenpyxlで読み込みます: {str(e)}")
+            df = pl.read_excel(file_path, **sheet_options, engine="openpyxl", infer_schema_length=0,
+                               engine_options={"read_only": True})
+        headers = [header for header in df.columns[:9] if not header.startswith('__UNNAMED__')]  # A-I列
+
+        return df.select(headers), headers
     except Exception as e:
         print(f"Excelファイルの読み込み中にエラーが発生しました: {str(e)}")
         return pl.DataFrame(), []
 
 
+def iter_formatted_rows(df, format_func=None):
+    # 列単位でPythonのリストに変換し、フォーマット関数も列ごとに適用してから行にまとめる
+    columns = []
+    for col_idx, series in enumerate(df.iter_columns(), 1):
+        values = series.to_list()
+        if format_func:
+            values = [format_func(col_idx, value) for value in values]
+        columns.append(values)
+
+    return zip(*columns)
+
+
+def write_new_excel(df, file_path, headers, format_cells=True, format_func=None):
+    # 新規ファイルはXlsxWriterの省メモリモードで行単位に書き出す（URL形式の文字列もハイパーリンクにせず文字列のまま保存）
+    with xlsxwriter.Workbook(file_path, {'constant_memory': True, 'strings_to_urls': False}) as result_wb:
+        result_sheet = result_wb.add_worksheet()
+        result_sheet.write_row(0, 0, headers[:9])  # A-I列まで
+
+        if format_cells:
+            # 書式は列ごとに1つずつ作成して使い回す
+            formats = {kind: result_wb.add_format(props) for kind, props in CELL_FORMAT_PROPERTIES.items()}
+            column_formats = [formats[COLUMN_ALIGNMENT_KINDS[col_idx]] for col_idx in range(1, 10)]
+
+        for row_idx, row_data in enumerate(iter_formatted_rows(df, format_func), 1):
+            if format_cells:
+                for col_idx, value in enumerate(row_data):
+                    result_sheet.write(row_idx, col_idx, value, column_formats[col_idx])
+            else:
+                result_sheet.write_row(row_idx, 0, row_data)
+
+
 def write_dataframe_to_excel(df, file_path, headers, create_new=False, format_cells=True, format_func=None):
     try:
+        df = df.select(df.columns[:9])  # A-I列まで
+
+        if format_cells:
+            # 並べ替えはシートに書き込む前にデータフレーム上で行う
+            df = sort_dataframe_rows(df)
+
         if create_new or not os.path.exists(file_path):
-            result_wb = openpyxl.Workbook()
-            result_sheet = result_wb.active
-        else:
-            result_wb = openpyxl.load_workbook(file_path)
-            result_sheet = result_wb.active
-
-            # 既存のデータをクリア (セルの値のみを消去し、書式は保持)
-            data_rows = result_sheet.max_row
-            data_cols = 9  # A-I列まで
-            for row in range(2, data_rows + 1):  # ヘッダー以外をクリア
-                for col in range(1, data_cols + 1):
-                    cell = result_sheet.cell(row=row, column=col)
-                    cell.value = None  # 値のみクリア
+            write_new_excel(df, file_path, headers, format_cells, format_func)
+            return True
+
+        result_wb = openpyxl.load_workbook(file_path)
+        result_sheet = result_wb.active
+
+        # 既存のデータをクリア (セルの値のみを消去し、書式は保持)
+        data_rows = result_sheet.max_row
+        data_cols = 9  # A-I列まで
+        for row in range(2, data_rows + 1):  # ヘッダー以外をクリア
+            for col in range(1, data_cols + 1):
+                cell = result_sheet.cell(row=row, column=col)
+                cell.value = None  # 値のみクリア
 
         # ヘッダーを書き込み（A-I列）
         for col_idx, header in enumerate(headers, 1):
@@ -114,19 +195,11 @@ def write_dataframe_to_excel(df, file_path, headers, create_new=False, format_ce
                 result_sheet.cell(row=1, column=col_idx, value=header)
 
         # データを書き込み（A-I列）
-        df_rows = df.rows()
-        for row_idx, row_data in enumerate(df_rows, 2):
+        for row_idx, row_data in enumerate(iter_formatted_rows(df, format_func), 2):
             for col_idx, value in enumerate(row_data, 1):
-                if col_idx <= 9:  # A-I列まで
-                    cell = result_sheet.cell(row=row_idx, column=col_idx)
-                    
-                    if format_func:
-                        cell.value = format_func(col_idx, value)
-                    else:
-                        cell.value = value
+                result_sheet.cell(row=row_idx, column=col_idx).value = value
 
         if format_cells:
-            sort_worksheet_data(result_sheet)
             apply_cell_formats(result_sheet, 2)  # 2行目（データ行の開始）から適用
 
         result_wb.save(file_path)
@@ -1,10 +1,13 @@
 import os
+import subprocess
+import sys
 from shutil import copyfile
 
 import openpyxl
 import polars as pl
+import xlsxwriter
 
-from config_manager import load_config
+from config_manager import get_clinical_departments, get_ordered_names, load_config
 from service_data_processor import filter_dataframe_by_date_range
 from service_excel_handler import read_excel_to_dataframe
 
@@ -13,6 +16,14 @@ def analyze_medical_documents(file_path, excel_template_path, start_date_str=Non
     config = load_config()
 
     try:
+        # configからスタッフと診療科の情報を取得
+        staff_members = get_ordered_names(config)
+        departments = get_clinical_departments(config)
+
+        # 担当者または診療科が未設定の場合は、データを読み込まずに終了する
+        if not staff_members or not departments:
+            print("分析対象の担当者/診療科が未設定です")
+            return
 
         df, _ = read_excel_to_dataframe(file_path)
 
@@ -28,35 +39,31 @@ def analyze_medical_documents(file_path, excel_template_path, start_date_str=Non
         end_date_display = date_result['end_date_display']
         file_date_range = date_result['file_date_range']
 
-        # データの集計
-        grouped = df.filter(
-            pl.col('担当者名').is_not_null() & pl.col('診療科').is_not_null()
-        ).group_by(['担当者名', '診療科']).agg(
+        # データの集計（元データの走査は1回のみ。合計は組み合わせ別の件数から求める）
+        # 担当者名・診療科の片方が空の行も各合計には含めるため、null を含めて集計しておく
+        all_grouped = df.group_by(['担当者名', '診療科']).agg(
             pl.len().alias('作成件数')
         )
 
-        staff_totals = df.filter(
+        grouped = all_grouped.filter(
+            pl.col('担当者名').is_not_null() & pl.col('診療科').is_not_null()
+        )
+
+        staff_totals = all_grouped.filter(
             pl.col('担当者名').is_not_null()
         ).group_by('担当者名').agg(
-            pl.len().alias('作成件数')
+            pl.col('作成件数').sum()
         ).sort('担当者名')
 
-        dept_totals = df.filter(
+        dept_totals = all_grouped.filter(
             pl.col('診療科').is_not_null()
         ).group_by('診療科').agg(
-            pl.len().alias('作成件数')
+            pl.col('作成件数').sum()
         ).sort('作成件数', descending=True)
 
-        # configからスタッフと診療科の情報を取得
-        ordered_names_str = config['Analysis'].get('ordered_names', "")
-        staff_members = [name.strip() for name in ordered_names_str.split(',')] if ordered_names_str else []
-
-        config_departments_str = config['Analysis'].get('clinical_departments', "")
-        departments = [dept.strip() for dept in config_departments_str.split(',')] if config_departments_str else []
-
         # 集計結果をExcelに出力
         output_excel(excel_template_path, staff_members, departments, grouped, staff_totals,
-                     dept_totals, start_date_display, end_date_display, file_date_range)
+                     dept_totals, start_date_display, end_date_display, file_date_range, config=config)
 
     except FileNotFoundError:
         print(f"エラー: ファイル '{file_path}' が見つかりません。")
@@ -64,77 +71,85 @@ def analyze_medical_documents(file_path, excel_template_path, start_date_str=Non
         print(f"エラー: データの読み込み中に問題が発生しました - {str(e)}")
 
 
-def output_excel(excel_template_path, staff_members, departments, grouped_data, staff_totals,
-                 dept_totals, start_date, end_date, file_date_range):
-    try:
-        config = load_config()
-        output_dir = config['PATHS']['output_dir']
+def build_summary_rows(title, staff_members, departments, counts_by_staff, dept_counts, total_docs):
+    # 1行目: タイトル、2行目: 見出し（診療科がない場合はNone）、3行目以降: 担当者ごとの件数、最終行: 合計
+    rows = [[title], ["氏名"] + departments if departments else None]
 
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        output_file = os.path.join(output_dir, f"医療文書作成件数{file_date_range}.xlsx")
-
-        if os.path.exists(excel_template_path):
-            copyfile(excel_template_path, output_file)
-            workbook = openpyxl.load_workbook(output_file)
-            sheet = workbook.active
-        else:
-            workbook = openpyxl.Workbook()
-            sheet = workbook.active
+    # 合計列を除いた診療科と、合計列を差し込む位置（氏名列の分を含む）を先に求めておく
+    data_departments = [dept for dept in departments if dept != '合計']
+    total_col = departments.index('合計') + 1 if '合計' in departments else None
 
-        sheet['A1'] = f"医療文書作成件数 {start_date}-{end_date}"
+    for staff in staff_members:
+        staff_counts = counts_by_staff.get(staff, {})
+        row_counts = [staff_counts.get(dept, 0) for dept in data_departments]
+        row = [staff] + row_counts
+        if total_col is not None:
+            row.insert(total_col, sum(row_counts))
+        rows.append(row)
 
-        if len(departments) > 0:
-            sheet['A2'] = "氏名"
-            for col_idx, dept in enumerate(departments, 2):
-                sheet.cell(row=2, column=col_idx).value = dept
+    total_row = ["合計"] + [dept_counts.get(dept, 0) for dept in data_departments]
+    if total_col is not None:
+        total_row.insert(total_col, total_docs)
+    rows.append(total_row)
+    return rows
 
-        has_total_column = '合計' in departments
-        total_column_idx = departments.index('合計') + 2 if has_total_column else 0
 
-        for row_idx, staff in enumerate(staff_members, 3):
-            sheet.cell(row=row_idx, column=1).value = staff
+def output_excel(excel_template_path, staff_members, departments, grouped_data, staff_totals,
+                 dept_totals, start_date, end_date, file_date_range, config=None):
+    try:
+        # 呼び出し元で読み込み済みの設定があれば再利用する
+        if config is None:
+            config = load_config()
+        output_dir = config['PATHS']['output_dir']
 
-            staff_total = 0
+        os.makedirs(output_dir, exist_ok=True)
 
-            for col_idx, dept in enumerate(departments, 2):
-                if dept == '合計':
-                    continue
+        output_file = os.path.join(output_dir, f"医療文書作成件数{file_date_range}.xlsx")
 
-                filtered_data = grouped_data.filter(
-                    (pl.col('担当者名') == staff) & (pl.col('診療科') == dept)
-                )
+        # 集計結果（担当者×診療科で数十行程度）を担当者ごとの辞書に展開する
+        counts_by_staff = {}
+        for staff, dept, count in grouped_data.select(['担当者名', '診療科', '作成件数']).iter_rows():
+            counts_by_staff.setdefault(staff, {})[dept] = count
+        dept_counts = dict(zip(dept_totals['診療科'], dept_totals['作成件数']))
+        total_docs = staff_totals['作成件数'].sum()
 
-                if filtered_data.height > 0:
-                    count = filtered_data.select('作成件数').item()
-                    sheet.cell(row=row_idx, column=col_idx).value = count
-                    staff_total += count
-                else:
-                    sheet.cell(row=row_idx, column=col_idx).value = 0
+        rows = build_summary_rows(f"医療文書作成件数 {start_date}-{end_date}", staff_members, departments,
+                                  counts_by_staff, dept_counts, total_docs)
 
-            if has_total_column:
-                sheet.cell(row=row_idx, column=total_column_idx).value = staff_total
+        # テンプレートの書式を保持するため、テンプレートのコピーに値だけを書き込む
+        try:
+            copyfile(excel_template_path, output_file)
+            has_template = True
+        except FileNotFoundError:
+            has_template = False
 
-        total_row = len(staff_members) + 3
-        sheet.cell(row=total_row, column=1).value = "合計"
+        if has_template:
+            workbook = openpyxl.load_workbook(output_file)
+            sheet = workbook.active
 
-        for col_idx, dept in enumerate(departments, 2):
-            if dept == '合計':
-                continue
+            for row_idx, row_values in enumerate(rows, 1):
+                if row_values is None:
+                    continue
+                for col_idx, value in enumerate(row_values, 1):
+                    sheet.cell(row=row_idx, column=col_idx).value = value
 
-            dept_data = dept_totals.filter(pl.col('診療科') == dept)
-            if dept_data.height > 0:
-                sheet.cell(row=total_row, column=col_idx).value = dept_data.select('作成件数').item()
+            workbook.save(output_file)
+        else:
+            # テンプレートがない場合は新規ブックをXlsxWriterで書き出す
+            with xlsxwriter.Workbook(output_file) as workbook:
+                sheet = workbook.add_worksheet()
+                for row_idx, row_values in enumerate(rows):
+                    if row_values is not None:
+                        sheet.write_row(row_idx, 0, row_values)
+
+        # 保存は完了しているため、Excelの起動に失敗しても出力結果は有効として扱う
+        try:
+            if sys.platform == 'win32':
+                os.startfile(output_file)
             else:
-                sheet.cell(row=total_row, column=col_idx).value = 0
-
-        total_docs = staff_totals.select('作成件数').sum().item()
-        if has_total_column:
-            sheet.cell(row=total_row, column=total_column_idx).value = total_docs
-
-        workbook.save(output_file)
-        os.system(f'start excel.exe "{output_file}"')
+                subprocess.Popen(['xdg-open', output_file])
+        except Exception as e:
+            print(f"警告: 出力ファイルを開けませんでした - {str(e)}")
 
     except Exception as e:
         print(f"エラー: Excelファイルの出力中に問題が発生しました - {str(e)}")
@@ -1,4 +1,5 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import polars as pl
 
@@ -7,80 +8,80 @@ from service_excel_handler import (
     backup_excel_file, read_excel_to_dataframe, write_dataframe_to_excel
 )
 from service_data_processor import (
-    process_cell_value, format_output_cell_value, clean_and_standardize_dataframe
+    process_column_values, format_output_cell_value, clean_and_standardize_dataframe
 )
 
+# 重複判定に使う列（預り日、患者ID、文書名、診療科、医師名）
+DUPLICATE_KEY_COLUMNS = ("預り日", "患者ID", "文書名", "診療科", "医師名")
+# 処理に必須の列
+REQUIRED_COLUMNS = DUPLICATE_KEY_COLUMNS + ("医師依頼日", "担当者名")
+
 
 def process_medical_documents(source_file, target_file):
     try:
         config = load_config()
         backup_dir = config['PATHS']['backup_dir']
 
-        source_df, headers = read_excel_to_dataframe(source_file, process_cell_value)
+        target_exists = os.path.exists(target_file)
+
+        # ソースとターゲットは独立したファイルなので並行して読み込む
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            source_future = executor.submit(read_excel_to_dataframe, source_file)
+            target_future = (
+                executor.submit(read_excel_to_dataframe, target_file)
+                if target_exists else None
+            )
+            source_df, headers = source_future.result()
+            target_df, target_headers = target_future.result() if target_future else (None, [])
+
+        if target_exists and not target_headers:
+            # 既存ファイルを読み込めないまま書き込むと、既存のデータが失われるため中止する
+            print(f"エラー: 既存ファイルを読み込めませんでした: {target_file}")
+            return False
+
+        source_df = process_column_values(source_df)
+        target_df = process_column_values(target_df)
 
         if source_df.height == 0:
             print("エラー: ソースシートにデータがありません")
             return False
 
-        if os.path.exists(target_file):
-            target_df, target_headers = read_excel_to_dataframe(target_file, process_cell_value)
-            
-            if target_df.height > 0:
-                # 文字列型に統一
-                source_df = source_df.select([pl.col(col).cast(pl.Utf8) for col in source_df.columns])
-                target_df = target_df.select([pl.col(col).cast(pl.Utf8) for col in target_df.columns])
-
-                # 列名が同じことを確保
-                if set(source_df.columns) == set(target_df.columns):
-                    target_df = target_df.select(source_df.columns)
-                    df = pl.concat([source_df, target_df])
-                else:
-                    print(f"警告: ソースとターゲットのカラム構造が異なります。")
-                    print(f"ソース: {source_df.columns}")
-                    print(f"ターゲット: {target_df.columns}")
-                    print("ソースファイルのデータのみを使用します。")
-                    df = source_df
-            else:
-                df = source_df
-        else:
-            df = source_df
-
-        # データの前処理
-        df = clean_and_standardize_dataframe(df)
-        
-        # 医師依頼日が空欄の行を削除
-        if "医師依頼日" in df.columns:
-            df = df.filter(pl.col("医師依頼日") != "")
-            print(f"空の医師依頼日を持つ行を削除した後: {len(df)} 行")
-        else:
-            print("警告: '医師依頼日'の列が見つかりません。この条件でのフィルタリングをスキップします。")
+        missing_columns = [col for col in REQUIRED_COLUMNS if col not in headers]
+        if missing_columns:
+            print(f"エラー: ソースファイルに必須の列がありません: {missing_columns}")
+            return False
 
-        # 担当者名が空欄の行を削除
-        if "担当者名" in df.columns:
-            df = df.filter(pl.col("担当者名") != "")
-            print(f"空の担当者名を持つ行を削除した後: {len(df)} 行")
-        else:
-            print("警告: '担当者名'の列が見つかりません。この条件でのフィルタリングをスキップします。")
+        # 医師依頼日または担当者名が空欄の行は取り込まない
+        has_required_fields = (pl.col("医師依頼日") != "") & (pl.col("担当者名") != "")
+        key_columns = list(DUPLICATE_KEY_COLUMNS)
+
+        # ソース内の重複行を削除（預り日、患者ID、文書名、診療科、医師名の組み合わせが同じ行）
+        source_lf = (
+            clean_and_standardize_dataframe(source_df.lazy())
+            .filter(has_required_fields)
+            .unique(subset=key_columns)
+        )
+
+        if target_df is not None and target_df.height > 0:
+            if tuple(target_headers) != tuple(headers):
+                print("エラー: ソースとターゲットのカラム構造が異なります。")
+                print(f"ソース: {headers}")
+                print(f"ターゲット: {target_headers}")
+                return False
 
-        # 重複行を削除（預り日、患者ID、文書名、診療科、医師名の組み合わせが同じ行）
-        required_columns = ["預り日", "患者ID", "文書名", "診療科", "医師名"]
-        missing_columns = [col for col in required_columns if col not in df.columns]
+            target_lf = clean_and_standardize_dataframe(target_df.lazy()).filter(has_required_fields)
 
-        if not missing_columns:
-            df = df.unique(subset=required_columns)
+            # ターゲットに既にある組み合わせを除いた新規行だけを追加する
+            new_rows = source_lf.join(target_lf.select(key_columns), on=key_columns, how="anti")
+            df = pl.concat([target_lf, new_rows], how="vertical_relaxed").collect()
         else:
-            print(f"警告: 次の列が見つからないため、重複削除をスキップします: {missing_columns}")
-            # 存在する列のみで重複削除を試みる
-            existing_columns = [col for col in required_columns if col in df.columns]
-            if existing_columns:
-                print(f"代わりに次の列で重複削除を行います: {existing_columns}")
-                df = df.unique(subset=existing_columns)
+            df = source_lf.collect()
 
         print(f"重複削除後: {len(df)} 行")
 
         success = write_dataframe_to_excel(
             df, target_file, headers, 
-            create_new=not os.path.exists(target_file),
+            create_new=not target_exists,
             format_func=format_output_cell_value
         )
 
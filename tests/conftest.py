@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+SHM_DIR = '/dev/shm'
+
+# TMPDIRを変更する前のtempfile.tempdir（終了時に元に戻すため保持する）
+ORIGINAL_TEMPDIR_KEY = pytest.StashKey[object]()
+
+
+def pytest_configure(config):
+    # Linuxではテスト用の一時ディレクトリをメモリ上(tmpfs)に作成する（TMPDIRが指定済みの場合はそれを優先）
+    if sys.platform.startswith('linux') and 'TMPDIR' not in os.environ and os.path.isdir(SHM_DIR) \
+            and os.access(SHM_DIR, os.W_OK):
+        config.stash[ORIGINAL_TEMPDIR_KEY] = tempfile.tempdir
+        os.environ['TMPDIR'] = SHM_DIR
+        tempfile.tempdir = None  # gettempdir()のキャッシュを破棄してTMPDIRを反映させる
+
+
+def pytest_unconfigure(config):
+    # テストセッションの終了時にTMPDIRとtempfile.tempdirを元に戻す
+    if ORIGINAL_TEMPDIR_KEY in config.stash:
+        os.environ.pop('TMPDIR', None)
+        tempfile.tempdir = config.stash[ORIGINAL_TEMPDIR_KEY]
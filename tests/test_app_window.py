@@ -1,27 +1,16 @@
 import pytest
 import configparser
+from contextlib import ExitStack
 from datetime import datetime
+from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
 from app_window import MedicalDocsAnalyzerGUI
-from config_manager import load_config
 
-
-def restore_config(config, original_config):
-    """configを元の状態に復元するヘルパーメソッド"""
-    for section in config.sections():
-        config.remove_section(section)
-    for section in original_config.sections():
-        if not config.has_section(section):
-            config.add_section(section)
-        for key, value in original_config[section].items():
-            config[section][key] = value
-
-
-@pytest.fixture
-def original_config():
-    """オリジナルのconfigを保存するフィクスチャ"""
-    return load_config()
+# DateEntryのモックが返す日付（実行日に依存しないよう固定する）
+FIXED_TODAY = datetime(2024, 1, 15).date()
+# 開始日が終了日より後になる日付の組み合わせ
+START_AFTER_END = (datetime(2025, 2, 1).date(), datetime(2025, 1, 1).date())
 
 
 @pytest.fixture
@@ -58,24 +47,22 @@ def mock_date_entry():
     """DateEntryのモックを作成するフィクスチャ"""
     with patch('app_window.DateEntry') as mock_date_entry:
         mock_date = MagicMock()
-        mock_date.get_date.return_value = datetime.now().date()
+        mock_date.get_date.return_value = FIXED_TODAY
         mock_date_entry.return_value = mock_date
         yield mock_date_entry
 
 
-@pytest.fixture
-def gui(original_config):
-    """GUIインスタンスを作成するフィクスチャ"""
+@pytest.fixture(scope='module')
+def gui():
+    """GUIインスタンスを作成するフィクスチャ（モジュール内で1度だけ生成して共有）"""
     # すべての外部依存をモック化
-    with patch('app_window.tk'), \
-            patch('app_window.ttk'), \
-            patch('app_window.DateEntry'), \
-            patch('app_window.process_medical_documents'), \
-            patch('app_window.messagebox'), \
-            patch('app_window.MedicalDocsAnalyzer') as mock_analyzer:
-        # tkとttkのモックを取得
-        mock_tk = pytest.importorskip('app_window').tk
-        mock_ttk = pytest.importorskip('app_window').ttk
+    with ExitStack() as stack:
+        mock_tk = stack.enter_context(patch('app_window.tk'))
+        mock_ttk = stack.enter_context(patch('app_window.ttk'))
+        mock_date_entry = stack.enter_context(patch('app_window.DateEntry'))
+        mock_process = stack.enter_context(patch('app_window.process_medical_documents'))
+        mock_messagebox = stack.enter_context(patch('app_window.messagebox'))
+        stack.enter_context(patch('app_window.MedicalDocsAnalyzer'))
 
         # ルートとフレームのモック
         mock_root = MagicMock()
@@ -95,19 +82,26 @@ def gui(original_config):
 
         # DateEntryのモック
         mock_date = MagicMock()
-        mock_date.get_date.return_value = datetime.now().date()
-        pytest.importorskip('app_window').DateEntry.return_value = mock_date
+        mock_date.get_date.return_value = FIXED_TODAY
+        mock_date_entry.return_value = mock_date
 
         # GUIのインスタンスを作成
         gui = MedicalDocsAnalyzerGUI(mock_root)
 
         # _setup_buttonsメソッドが実際に呼び出されたかを確認するためのスパイを追加
         gui._setup_buttons_called = mock_ttk.Button.call_count
+        gui._mocks = SimpleNamespace(tk=mock_tk, ttk=mock_ttk, date_entry=mock_date_entry,
+                                     process=mock_process, messagebox=mock_messagebox)
 
         yield gui
 
-        # テスト後に設定を元に戻す
-        restore_config(gui.config, original_config)
+
+@pytest.fixture
+def gui_mocks(gui):
+    """テストごとに呼び出し履歴と戻り値をリセットしたGUIのモックを返すフィクスチャ"""
+    for mock in (gui._mocks.process, gui._mocks.messagebox):
+        mock.reset_mock(return_value=True, side_effect=True)
+    return gui._mocks
 
 
 class TestMedicalDocsAnalyzerGUI:
@@ -126,7 +120,7 @@ class TestMedicalDocsAnalyzerGUI:
         assert hasattr(gui, 'end_date')
 
         # DateEntryが呼ばれたことを確認
-        assert pytest.importorskip('app_window').DateEntry.call_count >= 2
+        assert gui._mocks.date_entry.call_count >= 2
 
     def test_setup_buttons(self, gui):
         """ボタンの設定が正しく行われるかテスト"""
@@ -134,127 +128,87 @@ class TestMedicalDocsAnalyzerGUI:
         buttons_called = gui._setup_buttons_called > 0
         assert buttons_called, "ボタンの設定メソッドが呼ばれていない"
 
-    @patch('app_window.process_medical_documents')
-    @patch('app_window.messagebox')
-    def test_load_data_success(self, mock_messagebox, mock_process, gui):
-        """データ読込の成功パターンをテスト"""
-        mock_process.return_value = True
+    @pytest.mark.parametrize("process_result, process_error, expected_method, expected_message", [
+        (True, None, "showinfo", "データ読込が完了しました。"),
+        (False, None, "showerror", "データ読込中にエラーが発生しました。"),
+        (None, Exception("テストエラー"), "showerror", "予期せぬエラー"),
+    ], ids=["success", "failure", "exception"])
+    def test_load_data(self, gui, gui_mocks, process_result, process_error, expected_method, expected_message):
+        """データ読込の成功・失敗・例外パターンをテスト"""
+        mock_process = gui_mocks.process
+        mock_process.return_value = process_result
+        mock_process.side_effect = process_error
 
         # save_date_to_configをモックに置き換え
         with patch.object(gui, 'save_date_to_config', return_value=True):
             gui.load_data()
 
-            # process_medical_documentsが呼ばれたことを確認
-            mock_process.assert_called_once()
-
-            # 成功メッセージが表示されたことを確認
-            mock_messagebox.showinfo.assert_called_once_with("完了", "データ読込が完了しました。")
+        # process_medical_documentsが呼ばれたことを確認
+        mock_process.assert_called_once()
 
-    @patch('app_window.process_medical_documents')
-    @patch('app_window.messagebox')
-    def test_load_data_failure(self, mock_messagebox, mock_process, gui):
-        """データ読込の失敗パターンをテスト"""
-        mock_process.return_value = False
-
-        # save_date_to_configをモックに置き換え
-        with patch.object(gui, 'save_date_to_config', return_value=True):
-            gui.load_data()
-
-            # process_medical_documentsが呼ばれたことを確認
-            mock_process.assert_called_once()
-
-            # エラーメッセージが表示されたことを確認
-            mock_messagebox.showerror.assert_called_once_with("エラー", "データ読込中にエラーが発生しました。")
-
-    @patch('app_window.process_medical_documents')
-    @patch('app_window.messagebox')
-    def test_load_data_exception(self, mock_messagebox, mock_process, gui):
-        """データ読込でExceptionが発生した場合のテスト"""
-        mock_process.side_effect = Exception("テストエラー")
-
-        # save_date_to_configをモックに置き換え
-        with patch.object(gui, 'save_date_to_config', return_value=True):
-            gui.load_data()
-
-            # エラーメッセージが表示されたことを確認
-            mock_messagebox.showerror.assert_called_once()
-            assert "予期せぬエラー" in mock_messagebox.showerror.call_args[0][1]
+        # 結果に応じたメッセージが表示されたことを確認
+        message_box = getattr(gui_mocks.messagebox, expected_method)
+        message_box.assert_called_once()
+        assert expected_message in message_box.call_args[0][1]
 
     @patch('app_window.save_config')
-    @patch('app_window.messagebox')
-    def test_save_date_to_config_success(self, mock_messagebox, mock_save_config, gui):
+    def test_save_date_to_config_success(self, mock_save_config, gui):
         """設定の保存が成功する場合のテスト"""
-        # 開始日と終了日のget_dateが同じ日付を返すようにモック化済み
-        result = gui.save_date_to_config()
+        # 共有のgui.configを書き換えないよう、使い捨てのconfigに差し替える
+        with patch.object(gui, 'config', configparser.ConfigParser()) as config:
+            # 開始日と終了日のget_dateが同じ日付を返すようにモック化済み
+            result = gui.save_date_to_config()
 
         assert result is True
-        mock_save_config.assert_called_once_with(gui.config)
-        assert 'Analysis' in gui.config
-        assert 'start_date' in gui.config['Analysis']
-        assert 'end_date' in gui.config['Analysis']
+        mock_save_config.assert_called_once_with(config)
+        assert 'Analysis' in config
+        assert 'start_date' in config['Analysis']
+        assert 'end_date' in config['Analysis']
 
     @patch('app_window.save_config')
-    @patch('app_window.messagebox')
-    def test_save_date_to_config_invalid_date(self, mock_messagebox, mock_save_config, gui):
+    def test_save_date_to_config_invalid_date(self, mock_save_config, gui, gui_mocks):
         """終了日より後の開始日を設定した場合のテスト"""
         # 開始日が終了日より後になるようにモック
-        with patch.object(gui, 'start_date') as mock_start_date, \
+        with patch.object(gui, 'config', configparser.ConfigParser()), \
+                patch.object(gui, 'start_date') as mock_start_date, \
                 patch.object(gui, 'end_date') as mock_end_date:
-            mock_start_date.get_date.return_value = datetime(2025, 2, 1).date()
-            mock_end_date.get_date.return_value = datetime(2025, 1, 1).date()
+            mock_start_date.get_date.return_value, mock_end_date.get_date.return_value = START_AFTER_END
 
             result = gui.save_date_to_config()
 
             assert result is False
+            mock_messagebox = gui_mocks.messagebox
             mock_messagebox.showerror.assert_called_once()
             assert "開始日が終了日より後の日付" in mock_messagebox.showerror.call_args[0][1]
             mock_save_config.assert_not_called()
 
-    @patch('app_window.messagebox')
-    def test_start_analysis_success(self, mock_messagebox, gui):
-        """分析開始が成功する場合のテスト"""
-        # save_date_to_configをモックに置き換え
-        with patch.object(gui, 'save_date_to_config', return_value=True):
-            # analyzerのrun_analysisをモックに置き換え
-            gui.analyzer.run_analysis = MagicMock(return_value=(True, "成功"))
-
-            gui.start_analysis()
-
-            # run_analysisが呼ばれたことを確認
-            gui.analyzer.run_analysis.assert_called_once()
-
-            # エラーメッセージが表示されなかったことを確認
-            mock_messagebox.showerror.assert_not_called()
-
-    @patch('app_window.messagebox')
-    def test_start_analysis_date_error(self, mock_messagebox, gui):
-        """日付設定でエラーが発生した場合のテスト"""
-        # save_date_to_configをモックに置き換え
-        with patch.object(gui, 'save_date_to_config', return_value=False):
-            # analyzerのrun_analysisをモックに置き換え
-            gui.analyzer.run_analysis = MagicMock()
-
-            gui.start_analysis()
-
-            # run_analysisが呼ばれなかったことを確認
-            gui.analyzer.run_analysis.assert_not_called()
-
-    @patch('app_window.messagebox')
-    def test_start_analysis_exception(self, mock_messagebox, gui):
-        """分析実行中に例外が発生した場合のテスト"""
-        # save_date_to_configをモックに置き換え
-        with patch.object(gui, 'save_date_to_config', return_value=True):
-            # analyzerのrun_analysisをモックに置き換え
-            gui.analyzer.run_analysis = MagicMock(side_effect=Exception("テストエラー"))
-
+    @pytest.mark.parametrize("date_saved, run_error, expect_run, expect_error", [
+        (True, None, True, False),
+        (False, None, False, False),
+        (True, Exception("テストエラー"), True, True),
+    ], ids=["success", "date_error", "exception"])
+    def test_start_analysis(self, gui, gui_mocks, date_saved, run_error, expect_run, expect_error):
+        """分析開始の成功・日付エラー・例外パターンをテスト"""
+        mock_messagebox = gui_mocks.messagebox
+        original_run_analysis = gui.analyzer.run_analysis
+
+        # save_date_to_configとanalyzerのrun_analysisをこのテストの間だけモックに置き換え
+        with patch.object(gui, 'save_date_to_config', return_value=date_saved), \
+                patch.object(gui.analyzer, 'run_analysis', return_value=(True, "成功"),
+                             side_effect=run_error) as mock_run_analysis:
             gui.start_analysis()
 
-            # run_analysisが呼ばれたことを確認
-            gui.analyzer.run_analysis.assert_called_once()
+        # 日付設定に成功した場合のみrun_analysisが呼ばれることを確認
+        assert mock_run_analysis.called is expect_run
+        # 共有しているguiのrun_analysisは元に戻っていることを確認
+        assert gui.analyzer.run_analysis is original_run_analysis
 
-            # エラーメッセージが表示されたことを確認
+        # 例外が発生した場合のみエラーメッセージが表示されることを確認
+        if expect_error:
             mock_messagebox.showerror.assert_called_once()
             assert "予期せぬエラー" in mock_messagebox.showerror.call_args[0][1]
+        else:
+            mock_messagebox.showerror.assert_not_called()
 
     @patch('app_window.subprocess.Popen')
     def test_open_config_success(self, mock_popen, gui):
@@ -268,9 +222,9 @@ class TestMedicalDocsAnalyzerGUI:
         assert 'config_path' in gui.config['PATHS']
 
     @patch('app_window.subprocess.Popen')
-    @patch('app_window.messagebox')
-    def test_open_config_error(self, mock_messagebox, mock_popen, gui):
+    def test_open_config_error(self, mock_popen, gui, gui_mocks):
         """設定ファイルを開くエラーのテスト"""
+        mock_messagebox = gui_mocks.messagebox
         mock_popen.side_effect = Exception("テストエラー")
 
         gui.open_config()
@@ -0,0 +1,109 @@
+import configparser
+import io
+import os
+from unittest.mock import patch
+
+import pytest
+
+import config_manager
+from config_manager import get_clinical_departments, get_ordered_names, load_config
+
+CONFIG_TEXT = """[DEFAULT]
+base = C:/医療文書
+
+[PATHS]
+database_path = %(base)s/database.xlsx
+
+[Analysis]
+ordered_names = 山本,中野
+"""
+
+
+def config_text(config):
+    """configをファイルに保存した場合の内容を返すヘルパー関数"""
+    buffer = io.StringIO()
+    config.write(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def config_path(tmp_path, monkeypatch):
+    """テスト用の設定ファイルを作成し、キャッシュを空にするfixture"""
+    path = tmp_path / 'config.ini'
+    path.write_text(CONFIG_TEXT, encoding='utf-8')
+    monkeypatch.setattr(config_manager, 'CONFIG_PATH', str(path))
+    monkeypatch.setattr(config_manager, '_config_cache', {})
+    return path
+
+
+def test_load_config_uses_cache_when_unchanged(config_path):
+    # 2回目は解析済みの内容から復元し、同じ設定を返す
+    with patch('config_manager._parse_config_text', wraps=config_manager._parse_config_text) as mock_parse:
+        first = load_config()
+        second = load_config()
+
+    mock_parse.assert_called_once()
+    assert second is not first
+    assert config_text(second) == config_text(first)
+
+
+def test_load_config_reloads_after_same_size_edit(config_path):
+    assert load_config()['Analysis']['ordered_names'] == "山本,中野"
+
+    # サイズが同じで更新日時も変わらない編集でも、内容の変化を検知して読み直す
+    stat = config_path.stat()
+    config_path.write_text(CONFIG_TEXT.replace("山本,中野", "中野,山本"), encoding='utf-8')
+    os.utime(config_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert load_config()['Analysis']['ordered_names'] == "中野,山本"
+
+
+def test_load_config_keeps_default_section_on_cache_hit(config_path):
+    load_config()
+    config = load_config()
+
+    # [DEFAULT]の値は各セクションにコピーされず、そのまま書き戻せる
+    assert config.defaults() == {'base': 'C:/医療文書'}
+    assert config['PATHS']['database_path'] == 'C:/医療文書/database.xlsx'
+    assert config_text(config) == CONFIG_TEXT + "\n"
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("内科,外科,眼科", ["内科", "外科", "眼科"]),
+    ("内科 , 外科,\t眼科", ["内科", "外科", "眼科"]),
+    ("  内科,外科  ", ["内科", "外科"]),
+    ("内科,外科,", ["内科", "外科"]),
+    ("内科,,外科, ,眼科", ["内科", "外科", "眼科"]),
+    ("", []),
+    ("  ", []),
+], ids=["separator", "whitespace", "surrounding_spaces", "trailing_comma", "empty_items", "empty", "blank"])
+@pytest.mark.parametrize("key, getter", [
+    ('ordered_names', get_ordered_names),
+    ('clinical_departments', get_clinical_departments),
+], ids=["ordered_names", "clinical_departments"])
+def test_get_config_list(key, getter, value, expected):
+    config = configparser.ConfigParser()
+    config['Analysis'] = {key: value}
+
+    assert getter(config) == expected
+
+
+@pytest.mark.parametrize("getter", [get_ordered_names, get_clinical_departments],
+                         ids=["ordered_names", "clinical_departments"])
+def test_get_config_list_missing_key(getter):
+    # 設定値がない場合は空のリストを返す
+    config = configparser.ConfigParser()
+    config['Analysis'] = {}
+
+    assert getter(config) == []
+
+
+def test_get_config_list_returns_new_list():
+    # 返したリストを変更しても、キャッシュした分解結果には影響しない
+    config = configparser.ConfigParser()
+    config['Analysis'] = {'ordered_names': '山本,中野'}
+
+    names = get_ordered_names(config)
+    names.append('追加')
+
+    assert get_ordered_names(config) == ['山本', '中野']
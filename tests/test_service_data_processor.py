@@ -1,10 +1,9 @@
 import pytest
 import datetime
 import polars as pl
-from unittest.mock import MagicMock
 
 from service_data_processor import (
-    process_cell_value,
+    process_column_values,
     format_date_string,
     format_output_cell_value,
     parse_date_to_formats,
@@ -13,96 +12,74 @@ from service_data_processor import (
 )
 
 
-class TestProcessCellValue:
-    def test_none_value(self):
-        assert process_cell_value(None) is None
-
-    def test_no_column_attribute(self):
-        cell = MagicMock()
-        del cell.column
-        assert process_cell_value(cell) is None
-
-    def test_column_1_datetime(self):
-        cell = MagicMock()
-        cell.column = 1
-        cell.value = datetime.datetime(2023, 5, 15)
-        assert process_cell_value(cell) == "2023/05/15"
-
-    def test_column_1_string(self):
-        cell = MagicMock()
-        cell.column = 1
-        cell.value = "2023-05-15"
-        assert process_cell_value(cell) == "2023-05-15"
-
-    def test_column_2_numeric_string(self):
-        cell = MagicMock()
-        cell.column = 2
-        cell.value = "12345"
-        assert process_cell_value(cell) == 12345
-
-    def test_column_2_non_numeric_string(self):
-        cell = MagicMock()
-        cell.column = 2
-        cell.value = "ABC123"
-        assert process_cell_value(cell) == "ABC123"
-
-    def test_column_8_datetime(self):
-        cell = MagicMock()
-        cell.column = 8
-        cell.value = datetime.datetime(2023, 6, 20)
-        assert process_cell_value(cell) == "2023/06/20"
-
-    def test_other_column(self):
-        cell = MagicMock()
-        cell.column = 5
-        cell.value = "テストデータ"
-        assert process_cell_value(cell) == "テストデータ"
-
-
-class TestFormatDateString:
-    def test_empty_string(self):
-        assert format_date_string("") == ""
-
-    def test_none_value(self):
-        assert format_date_string(None) is None
+class TestProcessColumnValues:
+    @staticmethod
+    def make_df(date_value="", patient_id="", request_date=""):
+        return pl.DataFrame({
+            '預り日': [date_value],
+            '患者ID': [patient_id],
+            '文書名': ['診断書'],
+            '担当者名': ['山本'],
+            '診療科': ['内科'],
+            '医師名': ['佐藤医師'],
+            '備考': [None],
+            '医師依頼日': [request_date],
+            'メモ': [None]
+        })
 
-    def test_hyphen_date(self):
-        assert format_date_string("2023-05-15") == "2023/05/15"
+    def test_none_dataframe(self):
+        assert process_column_values(None) is None
 
-    def test_slash_date(self):
-        assert format_date_string("2023/05/15") == "2023/05/15"
+    def test_empty_dataframe(self):
+        df = pl.DataFrame()
+        assert process_column_values(df).height == 0
+
+    @pytest.mark.parametrize("column, kwargs, expected", [
+        ('預り日', {'date_value': "2023-05-15 00:00:00"}, "2023/05/15"),
+        ('預り日', {'date_value': "2023-05-15"}, "2023-05-15"),
+        ('患者ID', {'patient_id': " 012345"}, "12345"),
+        ('患者ID', {'patient_id': "ABC123"}, "ABC123"),
+        ('医師依頼日', {'request_date': "2023-06-20 00:00:00"}, "2023/06/20"),
+    ], ids=["column_1_datetime", "column_1_string", "column_2_numeric_string",
+            "column_2_non_numeric_string", "column_8_datetime"])
+    def test_converted_columns(self, column, kwargs, expected):
+        result = process_column_values(self.make_df(**kwargs))
+        assert result[column][0] == expected
 
-    def test_datetime_with_time(self):
-        assert format_date_string("2023-05-15 10:30:00") == "2023/05/15"
+    def test_other_column(self):
+        result = process_column_values(self.make_df())
+        assert result['担当者名'][0] == "山本"
+        assert result['備考'][0] is None
 
-    def test_invalid_date_format(self):
-        assert format_date_string("2023.05.15") == "2023.05.15"
 
-    def test_numeric_input(self):
-        assert format_date_string(20230515) == 20230515
+class TestFormatDateString:
+    @pytest.mark.parametrize("value, expected", [
+        ("", ""),
+        (None, None),
+        ("2023-05-15", "2023/05/15"),
+        ("2023/05/15", "2023/05/15"),
+        ("2023-05-15 10:30:00", "2023/05/15"),
+        ("2023.05.15", "2023.05.15"),
+        (20230515, 20230515),
+    ], ids=["empty_string", "none_value", "hyphen_date", "slash_date", "datetime_with_time",
+            "invalid_date_format", "numeric_input"])
+    def test_format_date_string(self, value, expected):
+        assert format_date_string(value) == expected
 
 
 class TestFormatOutputCellValue:
-    def test_column_1_date(self):
-        assert format_output_cell_value(1, "2023-05-15") == "2023/05/15"
-
-    def test_column_8_date(self):
-        assert format_output_cell_value(8, "2023-05-15") == "2023/05/15"
-
-    def test_column_2_numeric_string(self):
-        assert format_output_cell_value(2, "12345") == 12345
-
-    def test_column_2_none(self):
-        assert format_output_cell_value(2, None) is None
-
-    def test_column_2_empty_string(self):
-        assert format_output_cell_value(2, "") == ""
-
-    def test_column_2_non_numeric(self):
-        assert format_output_cell_value(2, "ABC") == "ABC"
-
-    def test_other_column(self):
-        assert format_output_cell_value(5, "テストデータ") == "テストデータ"
+    @pytest.mark.parametrize("col_idx, value, expected", [
+        (1, "2023-05-15", "2023/05/15"),
+        (8, "2023-05-15", "2023/05/15"),
+        (2, "12345", 12345),
+        (2, None, None),
+        (2, "", ""),
+        (2, "ABC", "ABC"),
+        (5, "テストデータ", "テストデータ"),
+    ], ids=["column_1_date", "column_8_date", "column_2_numeric_string", "column_2_none",
+            "column_2_empty_string", "column_2_non_numeric", "other_column"])
+    def test_format_output_cell_value(self, col_idx, value, expected):
+        assert format_output_cell_value(col_idx, value) == expected
 
 
 class TestParseDateToFormats:
@@ -114,24 +91,35 @@ class TestParseDateToFormats:
         result = parse_date_to_formats("  ")
         assert result == {'raw': '', 'file_format': '', 'display_format': ''}
 
-    def test_valid_date_string(self):
-        result = parse_date_to_formats("2023/05/15")
-        assert result['raw'] == datetime.datetime(2023, 5, 15, 0, 0)
-        assert result['file_format'] == "20230515"
-        assert result['display_format'] == "2023年05月15日"
+    @pytest.mark.parametrize("value, raw", [
+        ("2023/05/15", datetime.datetime(2023, 5, 15, 0, 0)),
+        (datetime.datetime(2023, 5, 15), datetime.datetime(2023, 5, 15)),
+    ], ids=["valid_date_string", "datetime_object"])
+    def test_valid_date(self, value, raw):
+        result = parse_date_to_formats(value)
+        assert result == {'raw': raw, 'file_format': "20230515", 'display_format': "2023年05月15日"}
 
     def test_invalid_date_string(self):
         result = parse_date_to_formats("不正な日付")
-        assert result['raw'] == "不正な日付"
-        assert result['file_format'] == "不正な日付"
-        assert result['display_format'] == "不正な日付"
+        assert result == {'raw': "不正な日付", 'file_format': "不正な日付", 'display_format': "不正な日付"}
+
+
+@pytest.fixture(scope="module")
+def df_dates():
+    # filter_dataframe_by_date_range は入力を変更しないため、モジュール内で共有する
+    return pl.DataFrame({
+        '預り日': ['2023/05/01', '2023/05/15', '2023/05/30'],
+        'ID': [1, 2, 3],
+        'Name': ['A', 'B', 'C']
+    })
+
 
-    def test_datetime_object(self):
-        date_obj = datetime.datetime(2023, 5, 15)
-        result = parse_date_to_formats(date_obj)
-        assert result['raw'] == date_obj
-        assert result['file_format'] == "20230515"
-        assert result['display_format'] == "2023年05月15日"
+@pytest.fixture(scope="module")
+def df_no_date():
+    return pl.DataFrame({
+        'ID': [1, 2, 3],
+        'Name': ['A', 'B', 'C']
+    })
 
 
 class TestFilterDataframeByDateRange:
@@ -150,37 +138,33 @@ class TestFilterDataframeByDateRange:
         assert result['end_date_display'] == '該当なし'
         assert result['file_date_range'] == 'no_data'
 
-    def test_no_date_column(self):
-        df = pl.DataFrame({
-            'ID': [1, 2, 3],
-            'Name': ['A', 'B', 'C']
-        })
-        result = filter_dataframe_by_date_range(df)
-        assert result['df'].equals(df)
+    def test_no_date_column(self, df_no_date):
+        result = filter_dataframe_by_date_range(df_no_date)
+        assert result['df'].equals(df_no_date)
         assert result['start_date_display'] == '該当なし'
         assert result['end_date_display'] == '該当なし'
         assert result['file_date_range'] == 'no_data'
 
-    def test_with_date_range(self):
-        df = pl.DataFrame({
-            '預り日': ['2023/05/01', '2023/05/15', '2023/05/30'],
-            'ID': [1, 2, 3],
-            'Name': ['A', 'B', 'C']
-        })
-        result = filter_dataframe_by_date_range(df, '2023-05-10', '2023-05-20')
+    def test_with_date_range(self, df_dates):
+        result = filter_dataframe_by_date_range(df_dates, '2023-05-10', '2023-05-20')
         assert result['df'].height == 1
         assert result['df']['預り日'][0] == '2023/05/15'
 
-    def test_date_formats(self):
-        df = pl.DataFrame({
-            '預り日': ['2023/05/01', '2023/05/15', '2023/05/30'],
-            'ID': [1, 2, 3]
-        })
-        result = filter_dataframe_by_date_range(df)
+    def test_date_formats(self, df_dates):
+        result = filter_dataframe_by_date_range(df_dates)
         assert result['start_date_display'] == '2023年05月01日'
         assert result['end_date_display'] == '2023年05月30日'
         assert result['file_date_range'] == '20230501-20230530'
 
+    def test_with_date_range_mixed_formats(self):
+        df = pl.DataFrame({
+            '預り日': ['2023-05-01', '2023-05-15', '2023/05/18 00:00:00', '2023/05/30', '不正な日付'],
+            'ID': [1, 2, 3, 4, 5]
+        })
+        result = filter_dataframe_by_date_range(df, '2023-05-10', '2023-05-20')
+        assert result['df']['ID'].to_list() == [2, 3]
+        assert result['file_date_range'] == '20230515-20230518'
+
 
 class TestCleanAndStandardizeDataframe:
     def test_empty_dataframe(self):
@@ -204,3 +188,15 @@ class TestCleanAndStandardizeDataframe:
         assert result['A'].to_list() == ['1', '', '3']
         assert result['B'].to_list() == ['X', '', 'Z']
         assert result['C'].to_list() == ['true', 'false', '']
+
+    def test_lazyframe(self):
+        lf = pl.DataFrame({
+            'A': [1, None, 3],
+            'B': ['X', None, 'Z']
+        }).lazy()
+        result = clean_and_standardize_dataframe(lf)
+        # LazyFrameのまま返され、collect後に変換が反映されていることを確認
+        assert isinstance(result, pl.LazyFrame)
+        collected = result.collect()
+        assert collected['A'].to_list() == ['1', '', '3']
+        assert collected['B'].to_list() == ['X', '', 'Z']
@@ -2,27 +2,31 @@ import os
 import pytest
 import shutil
 import configparser
+from contextlib import closing
 from pathlib import Path
 from datetime import datetime
-import tempfile
 
 import openpyxl
+from openpyxl.styles import Font
 import polars as pl
+import xlsxwriter
 from unittest.mock import patch, MagicMock, mock_open, ANY
 
-from service_medical_docs_analyzer import analyze_medical_documents, output_excel, MedicalDocsAnalyzer
-from config_manager import load_config
+from service_medical_docs_analyzer import (
+    analyze_medical_documents, build_summary_rows, output_excel, MedicalDocsAnalyzer
+)
 
 
-def restore_config(config, original_config):
-    """configを元の状態に復元するヘルパーメソッド"""
-    for section in config.sections():
-        config.remove_section(section)
-    for section in original_config.sections():
-        if not config.has_section(section):
-            config.add_section(section)
-        for key, value in original_config[section].items():
-            config[section][key] = value
+DATABASE_HEADERS = ['預り日', '患者ID', '患者名', '文書名', '診療科', '依頼医師名', '依頼部署', '医師依頼日', '担当者名']
+
+
+def create_test_excel(filepath, rows):
+    """テスト用のExcelファイルをXlsxWriterの省メモリモードで作成する関数"""
+    with xlsxwriter.Workbook(filepath, {'constant_memory': True}) as wb:
+        ws = wb.add_worksheet()
+        for row_idx, row_data in enumerate(rows):
+            ws.write_row(row_idx, 0, row_data)
+    return filepath
 
 
 @pytest.fixture
@@ -40,66 +44,45 @@ def mock_config():
     return config
 
 
-@pytest.fixture
-def temp_files():
-    # 一時ディレクトリとファイルを作成
-    temp_dir = tempfile.mkdtemp()
-    temp_db_path = os.path.join(temp_dir, 'test_database.xlsx')
-    temp_template_path = os.path.join(temp_dir, 'test_template.xlsx')
-    temp_output_dir = os.path.join(temp_dir, 'test_output')
-    os.makedirs(temp_output_dir, exist_ok=True)
-
-    # テスト用のExcelファイルを作成
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    headers = ['預り日', '患者ID', '患者名', '文書名', '診療科', '依頼医師名', '依頼部署', '医師依頼日', '担当者名']
-    for i, header in enumerate(headers, 1):
-        ws.cell(row=1, column=i).value = header
+@pytest.fixture(scope='session')
+def session_workbooks(tmp_path_factory):
+    # 内容が同じテスト用のExcelファイルはセッションで一度だけ作成する
+    workbook_dir = tmp_path_factory.mktemp("workbooks")
 
-    # テストデータを追加
     data = [
         ['2025/01/10', 12345, '患者A', '文書A', '内科', '医師A', '部署A', '2025/01/09', '山田'],
         ['2025/01/15', 23456, '患者B', '文書B', '外科', '医師B', '部署B', '2025/01/14', '佐藤'],
         ['2025/01/20', 34567, '患者C', '文書C', '皮膚科', '医師C', '部署C', '2025/01/19', '鈴木']
     ]
-    for i, row_data in enumerate(data, 2):
-        for j, value in enumerate(row_data, 1):
-            ws.cell(row=i, column=j).value = value
+    return {
+        'db_path': create_test_excel(str(workbook_dir / 'test_database.xlsx'), [DATABASE_HEADERS] + data),
+        'template_path': create_test_excel(str(workbook_dir / 'test_template.xlsx'), [["医療文書作成件数"]])
+    }
 
-    wb.save(temp_db_path)
 
-    # テンプレートファイルも作成
-    wb_template = openpyxl.Workbook()
-    ws_template = wb_template.active
-    ws_template['A1'] = "医療文書作成件数"
-    wb_template.save(temp_template_path)
+@pytest.fixture
+def temp_files(session_workbooks, tmp_path):
+    # テストごとの一時ディレクトリ（後片付けはpytestに任せる）に作成済みのExcelファイルをコピーする
+    temp_dir = str(tmp_path)
+    temp_db_path = os.path.join(temp_dir, 'test_database.xlsx')
+    temp_template_path = os.path.join(temp_dir, 'test_template.xlsx')
+    temp_output_dir = os.path.join(temp_dir, 'test_output')
+    os.makedirs(temp_output_dir, exist_ok=True)
+
+    shutil.copyfile(session_workbooks['db_path'], temp_db_path)
+    shutil.copyfile(session_workbooks['template_path'], temp_template_path)
 
-    yield {
+    return {
         'temp_dir': temp_dir,
         'db_path': temp_db_path,
         'template_path': temp_template_path,
         'output_dir': temp_output_dir
     }
 
-    # テスト後にクリーンアップ - 安全に削除
-    try:
-        for root, dirs, files in os.walk(temp_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                try:
-                    os.chmod(file_path, 0o777)
-                    os.unlink(file_path)
-                except:
-                    pass
-        shutil.rmtree(temp_dir, ignore_errors=True)
-    except:
-        pass
-
 
 @patch('service_medical_docs_analyzer.load_config')
-@patch('os.system')  # Excelを開かないようにパッチ
 @patch('service_medical_docs_analyzer.output_excel')  # output_excelをモック化
-def test_analyze_medical_documents(mock_output_excel, mock_os_system, mock_load_config, mock_config, temp_files):
+def test_analyze_medical_documents(mock_output_excel, mock_load_config, mock_config, temp_files):
     # モックの設定
     mock_load_config.return_value = mock_config
 
@@ -122,21 +105,18 @@ def test_analyze_medical_documents(mock_output_excel, mock_os_system, mock_load_
     # mock_output_excelが呼ばれたことを確認
     assert mock_output_excel.called
 
-    # os.systemが呼ばれないことを確認
-    mock_os_system.assert_not_called()
+    # 設定は一度だけ読み込み、output_excelに引き渡す
+    mock_load_config.assert_called_once()
+    assert mock_output_excel.call_args.kwargs['config'] is mock_config
 
 
 @patch('service_medical_docs_analyzer.load_config')
-@patch('os.system')  # Excelを開かないようにパッチ
-def test_analyze_medical_documents_no_data(mock_os_system, mock_load_config, mock_config, temp_files):
+@patch('service_medical_docs_analyzer.subprocess.Popen')  # Excelを開かないようにパッチ
+@patch('service_medical_docs_analyzer.sys.platform', 'linux')
+def test_analyze_medical_documents_no_data(mock_popen, mock_load_config, mock_config, temp_files):
     # 空のデータベースファイルを作成
     empty_db_path = os.path.join(temp_files['temp_dir'], 'empty_database.xlsx')
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    headers = ['預り日', '患者ID', '患者名', '文書名', '診療科', '依頼医師名', '依頼部署', '医師依頼日', '担当者名']
-    for i, header in enumerate(headers, 1):
-        ws.cell(row=1, column=i).value = header
-    wb.save(empty_db_path)
+    create_test_excel(empty_db_path, [DATABASE_HEADERS])
 
     # モックの設定
     mock_load_config.return_value = mock_config
@@ -149,97 +129,132 @@ def test_analyze_medical_documents_no_data(mock_os_system, mock_load_config, moc
         '2025-01-31'
     )
 
-    # os.systemが呼ばれないことを確認
-    mock_os_system.assert_not_called()
+    # データがない場合は出力ファイルを開かないことを確認
+    mock_popen.assert_not_called()
 
 
-@patch('os.system')  # Excelを開かないようにパッチ
-@patch('service_medical_docs_analyzer.os.path.exists')
-def test_output_excel(mock_path_exists, mock_os_system, mock_config, temp_files):
-    pass # 動作確認は手動で行う
+@pytest.mark.parametrize("use_template", [False, True], ids=["without_template", "with_template"])
+@patch('service_medical_docs_analyzer.subprocess.Popen', side_effect=OSError("起動失敗"))
+@patch('service_medical_docs_analyzer.sys.platform', 'linux')
+def test_output_excel_open_failure_keeps_file(mock_popen, mock_config, temp_files, use_template):
+    mock_config['PATHS']['output_dir'] = temp_files['output_dir']
+    template_path = temp_files['template_path'] if use_template else '存在しないテンプレート.xlsx'
+    grouped = pl.DataFrame({'担当者名': ['山田'], '診療科': ['内科'], '作成件数': [2]})
+    staff_totals = pl.DataFrame({'担当者名': ['山田'], '作成件数': [2]})
+    dept_totals = pl.DataFrame({'診療科': ['内科'], '作成件数': [2]})
 
+    output_excel(template_path, ['山田'], ['合計', '内科'], grouped, staff_totals,
+                 dept_totals, '2025/01/01', '2025/01/31', '20250101-20250131', config=mock_config)
 
-@patch('service_medical_docs_analyzer.analyze_medical_documents')
-@patch('os.system')  # Excelを開かないようにパッチ
-def test_medical_docs_analyzer_run_analysis(mock_os_system, mock_analyze, mock_config):
-    # 元のconfigをバックアップ
-    original_config = load_config()
-
-    try:
-        # テスト用configを設定
-        with patch('service_medical_docs_analyzer.load_config', return_value=mock_config):
-            analyzer = MedicalDocsAnalyzer()
-            success, message = analyzer.run_analysis('2025-01-01', '2025-01-31')
-
-            # analyze_medical_documentsが正しく呼ばれたか確認
-            mock_analyze.assert_called_once_with(
-                mock_config['PATHS']['database_path'],
-                mock_config['PATHS']['template_path'],
-                '2025-01-01',
-                '2025-01-31'
-            )
-
-            # 成功したことを確認
-            assert success
-            assert "集計が完了しました" in message
-    finally:
-        # 元のconfigに戻す
-        current_config = load_config()
-        restore_config(current_config, original_config)
-
-    # os.systemが呼ばれないことを確認
-    mock_os_system.assert_not_called()
+    # Excelの起動に失敗しても、保存済みの出力ファイルは残る
+    output_file = os.path.join(temp_files['output_dir'], '医療文書作成件数20250101-20250131.xlsx')
+    mock_popen.assert_called_once_with(['xdg-open', output_file])
+    with closing(openpyxl.load_workbook(output_file, read_only=True)) as wb:
+        assert next(wb.active.iter_rows(min_row=3, max_row=3, values_only=True)) == ('山田', 2, 2)
 
 
-@patch('service_medical_docs_analyzer.analyze_medical_documents')
-@patch('os.system')  # Excelを開かないようにパッチ
-def test_medical_docs_analyzer_run_analysis_error(mock_os_system, mock_analyze, mock_config):
-    # 例外を発生させるようにモックを設定
-    mock_analyze.side_effect = Exception("テストエラー")
+@patch('service_medical_docs_analyzer.subprocess.Popen')  # Excelを開かないようにパッチ
+@patch('service_medical_docs_analyzer.sys.platform', 'linux')
+def test_output_excel_with_template(mock_popen, mock_config, temp_files):
+    mock_config['PATHS']['output_dir'] = temp_files['output_dir']
+
+    # 書式を設定したテンプレートを作成
+    template_path = os.path.join(temp_files['temp_dir'], 'styled_template.xlsx')
+    wb = openpyxl.Workbook()
+    wb.active['A1'] = 'テンプレート'
+    wb.active['A1'].font = Font(bold=True)
+    wb.active['F1'] = '作成者欄'
+    wb.save(template_path)
+
+    grouped = pl.DataFrame({
+        '担当者名': ['山田', '山田', '佐藤'],
+        '診療科': ['内科', '外科', '外科'],
+        '作成件数': [2, 1, 1]
+    })
+    staff_totals = pl.DataFrame({'担当者名': ['山田', '佐藤'], '作成件数': [3, 1]})
+    dept_totals = pl.DataFrame({'診療科': ['内科', '外科'], '作成件数': [2, 2]})
+
+    output_excel(template_path, ['山田', '佐藤'], ['合計', '内科', '外科'], grouped, staff_totals,
+                 dept_totals, '2025/01/01', '2025/01/31', '20250101-20250131', config=mock_config)
+
+    # テンプレートのコピーに、件数が所定のセルへ書き込まれていることを確認
+    output_file = os.path.join(temp_files['output_dir'], '医療文書作成件数20250101-20250131.xlsx')
+    mock_popen.assert_called_once_with(['xdg-open', output_file])
+    with closing(openpyxl.load_workbook(output_file)) as wb:
+        sheet = wb.active
+        assert sheet['A1'].value == '医療文書作成件数 2025/01/01-2025/01/31'
+        assert sheet['A1'].font.bold == True  # テンプレートの書式は保持
+        assert sheet['F1'].value == '作成者欄'  # 書き込み範囲外のテンプレートの値も保持
+        rows = list(sheet.iter_rows(min_row=2, max_row=5, max_col=4, values_only=True))
+    assert rows == [
+        ('氏名', '合計', '内科', '外科'),
+        ('山田', 3, 2, 1),
+        ('佐藤', 1, 0, 1),
+        ('合計', 4, 2, 2),
+    ]
+
+
+@patch('service_medical_docs_analyzer.read_excel_to_dataframe')
+@patch('service_medical_docs_analyzer.load_config')
+def test_analyze_medical_documents_without_staff(mock_load_config, mock_read_excel, mock_config, temp_files):
+    # 担当者が未設定の場合はファイルを読み込まない
+    mock_config['Analysis']['ordered_names'] = ''
+    mock_load_config.return_value = mock_config
 
-    # 元のconfigをバックアップ
-    original_config = load_config()
+    analyze_medical_documents(temp_files['db_path'], temp_files['template_path'], '2025-01-01', '2025-01-31')
 
-    try:
-        # テスト用configを設定
-        with patch('service_medical_docs_analyzer.load_config', return_value=mock_config):
-            analyzer = MedicalDocsAnalyzer()
-            success, message = analyzer.run_analysis('2025-01-01', '2025-01-31')
+    mock_read_excel.assert_not_called()
 
-            # 失敗したことを確認
-            assert not success
-            assert "エラーが発生しました" in message
-    finally:
-        # 元のconfigに戻す
-        current_config = load_config()
-        restore_config(current_config, original_config)
 
-    # os.systemが呼ばれないことを確認
-    mock_os_system.assert_not_called()
+def test_build_summary_rows():
+    counts_by_staff = {'山田': {'内科': 2, '外科': 1}, '佐藤': {'内科': 1}}
+    dept_counts = {'内科': 3, '外科': 1}
 
+    rows = build_summary_rows("タイトル", ['山田', '佐藤', '鈴木'], ['合計', '内科', '外科', '皮膚科'],
+                              counts_by_staff, dept_counts, 4)
 
+    assert rows == [
+        ["タイトル"],
+        ["氏名", '合計', '内科', '外科', '皮膚科'],
+        ['山田', 3, 2, 1, 0],
+        ['佐藤', 1, 1, 0, 0],
+        ['鈴木', 0, 0, 0, 0],
+        ["合計", 4, 3, 1, 0],
+    ]
+
+
+def test_build_summary_rows_no_departments():
+    rows = build_summary_rows("タイトル", ['山田'], [], {}, {}, 0)
+
+    # 診療科がない場合は見出し行を書き込まない
+    assert rows == [["タイトル"], None, ['山田'], ["合計"]]
+
+
+@pytest.mark.parametrize("start_date, side_effect, expected_success, expected_message", [
+    ('2025-01-01', None, True, "集計が完了しました"),
+    ('2025-01-01', Exception("テストエラー"), False, "エラーが発生しました"),
+    ('不正な日付', ValueError("無効な日付形式"), False, "日付の形式が正しくありません"),
+], ids=["success", "error", "date_error"])
 @patch('service_medical_docs_analyzer.analyze_medical_documents')
-@patch('os.system')  # Excelを開かないようにパッチ
-def test_medical_docs_analyzer_run_analysis_date_error(mock_os_system, mock_analyze, mock_config):
-    # 日付エラーを発生させるようにモックを設定
-    mock_analyze.side_effect = ValueError("無効な日付形式")
-
-    # 元のconfigをバックアップ
-    original_config = load_config()
-
-    try:
-        # テスト用configを設定
-        with patch('service_medical_docs_analyzer.load_config', return_value=mock_config):
-            analyzer = MedicalDocsAnalyzer()
-            success, message = analyzer.run_analysis('不正な日付', '2025-01-31')
-
-            # 失敗したことを確認
-            assert not success
-            assert "日付の形式が正しくありません" in message
-    finally:
-        # 元のconfigに戻す
-        current_config = load_config()
-        restore_config(current_config, original_config)
-
-    # os.systemが呼ばれないことを確認
-    mock_os_system.assert_not_called()
+def test_medical_docs_analyzer_run_analysis(mock_analyze, mock_config, monkeypatch,
+                                            start_date, side_effect, expected_success, expected_message):
+    # 成功・例外・日付エラーのパターンをモックで設定
+    mock_analyze.side_effect = side_effect
+
+    # テスト用configを設定（テスト終了時に自動で元に戻る）
+    monkeypatch.setattr('service_medical_docs_analyzer.load_config', lambda: mock_config)
+
+    analyzer = MedicalDocsAnalyzer()
+    success, message = analyzer.run_analysis(start_date, '2025-01-31')
+
+    # analyze_medical_documentsが正しく呼ばれたか確認
+    mock_analyze.assert_called_once_with(
+        mock_config['PATHS']['database_path'],
+        mock_config['PATHS']['template_path'],
+        start_date,
+        '2025-01-31'
+    )
+
+    # 結果とメッセージを確認
+    assert success == expected_success
+    assert expected_message in message
@@ -1,5 +1,5 @@
 import os
-import tempfile
+from contextlib import closing
 from pathlib import Path
 import datetime
 import configparser
@@ -7,6 +7,7 @@ import configparser
 import pytest
 import openpyxl
 import polars as pl
+import xlsxwriter
 
 # テスト対象のモジュールをインポート
 import config_manager
@@ -14,15 +15,11 @@ from service_medical_docs_processor import process_medical_documents
 
 
 # テスト用のヘルパー関数
-def restore_config(config, original_config):
-    """configを元の状態に復元するヘルパーメソッド"""
-    for section in config.sections():
-        config.remove_section(section)
-    for section in original_config.sections():
-        if not config.has_section(section):
-            config.add_section(section)
-        for key, value in original_config[section].items():
-            config[section][key] = value
+def row_count(path):
+    """検証用に読み取り専用モードでアクティブシートを開き、値のある行数を数える"""
+    with closing(openpyxl.load_workbook(path, read_only=True, data_only=True)) as wb:
+        return sum(1 for row in wb.active.iter_rows(values_only=True)
+                   if any(value is not None for value in row))
 
 
 # テスト用のモック関数
@@ -31,38 +28,27 @@ def create_test_excel(filepath, data, headers=None):
     if not headers:
         headers = ["預り日", "患者ID", "文書名", "担当者名", "診療科", "医師名", "備考", "医師依頼日", "メモ"]
 
-    wb = openpyxl.Workbook()
-    ws = wb.active
-
-    # ヘッダー行を設定
-    for col_idx, header in enumerate(headers, 1):
-        ws.cell(row=1, column=col_idx).value = header
-
-    # データ行を設定
-    for row_idx, row_data in enumerate(data, 2):
-        for col_idx, value in enumerate(row_data, 1):
-            ws.cell(row=row_idx, column=col_idx).value = value
-
-    # ファイル保存
-    wb.save(filepath)
-    # 明示的にファイルハンドルを閉じる
-    wb.close()
+    # XlsxWriterの省メモリモードで、ヘッダー行とデータ行を順に書き出す
+    with xlsxwriter.Workbook(filepath, {'constant_memory': True}) as wb:
+        ws = wb.add_worksheet()
+        ws.write_row(0, 0, headers)
+        for row_idx, row_data in enumerate(data, 1):
+            ws.write_row(row_idx, 0, row_data)
     return filepath
 
 
 # fixtureの定義
 @pytest.fixture
-def temp_dir():
-    """一時的なディレクトリを作成するfixture"""
-    tmp_dir = tempfile.mkdtemp()
-    yield Path(tmp_dir)
-    # 後処理はpytestが自動的に行う
+def temp_dir(tmp_path):
+    """一時的なディレクトリを作成するfixture（後処理はpytestが自動的に行う）"""
+    return tmp_path
 
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def original_config():
-    """元の設定を保存するfixture"""
-    return config_manager.load_config()
+    """元の設定をセクションごとの辞書として保存するfixture（読み取り専用としてセッション内で共有）"""
+    config = config_manager.load_config()
+    return {section: dict(config.items(section, raw=True)) for section in config.sections()}
 
 
 @pytest.fixture
@@ -70,8 +56,8 @@ def test_config(temp_dir, original_config, monkeypatch):
     """テスト用の設定を作成するfixture"""
     config = configparser.ConfigParser()
 
-    # 元の設定をコピー
-    restore_config(config, original_config)
+    # 元の設定のスナップショットを一度に読み込む
+    config.read_dict(original_config)
 
     # PATHSセクションが存在することを確認
     if not config.has_section('PATHS'):
@@ -127,16 +113,7 @@ def test_process_medical_documents_new_file(temp_dir, test_config, sample_data):
     assert os.path.exists(target_path)
 
     # 作成されたファイルの内容を検証
-    try:
-        wb = openpyxl.load_workbook(target_path)
-        ws = wb.active
-        assert ws.max_row == len(sample_data) + 1  # ヘッダー行 + データ行
-        wb.close()
-    except Exception as e:
-        # 確実にクローズするための対策
-        if 'wb' in locals():
-            wb.close()
-        raise e
+    assert row_count(target_path) == len(sample_data) + 1  # ヘッダー行 + データ行
 
     # バックアップファイルの検証
     backup_dir = Path(test_config['PATHS']['backup_dir'])
@@ -168,15 +145,26 @@ def test_process_medical_documents_update_existing(temp_dir, test_config, sample
     assert update_result is True
 
     # 更新されたファイルの内容を検証
-    try:
-        wb = openpyxl.load_workbook(target_path)
-        ws = wb.active
-        assert ws.max_row == 3 + 1  # ヘッダー行 + 初期データ2行 + 新データ1行
-        wb.close()
-    except Exception as e:
-        if 'wb' in locals():
-            wb.close()
-        raise e
+    assert row_count(target_path) == 3 + 1  # ヘッダー行 + 初期データ2行 + 新データ1行
+
+
+def test_process_medical_documents_keeps_existing_rows(temp_dir, test_config, sample_data):
+    """既存ファイルにある組み合わせは追加せず、既存行を残すテスト"""
+    source_path = create_test_excel(test_config['PATHS']['source_file_path'], sample_data[:2])
+    target_path = test_config['PATHS']['database_path']
+    assert process_medical_documents(source_path, target_path) is True
+
+    # 重複判定の列が同じで、備考だけ異なる行と新規行を取り込む
+    updated_row = list(sample_data[0])
+    updated_row[6] = "再取込"
+    create_test_excel(source_path, [updated_row, sample_data[2]])
+    assert process_medical_documents(source_path, target_path) is True
+
+    with closing(openpyxl.load_workbook(target_path, read_only=True, data_only=True)) as wb:
+        remarks = [row[6] for row in wb.active.iter_rows(min_row=2, values_only=True)]
+
+    assert row_count(target_path) == len(sample_data) + 1
+    assert "再取込" not in remarks
 
 
 def test_process_medical_documents_empty_source(temp_dir, test_config):
@@ -196,6 +184,8 @@ def test_process_medical_documents_with_duplicates(temp_dir, test_config, sample
     """重複データの処理テスト"""
     # 重複を含むデータを作成
     duplicated_data = sample_data + [sample_data[0]]  # 1行目のデータを重複させる
+    expected_unique = len({tuple(row) for row in duplicated_data})
+    assert expected_unique < len(duplicated_data)  # 重複行が含まれていることを確認
 
     # テスト用のソースファイルを作成
     source_path = create_test_excel(test_config['PATHS']['source_file_path'], duplicated_data)
@@ -208,15 +198,7 @@ def test_process_medical_documents_with_duplicates(temp_dir, test_config, sample
     assert result is True
 
     # 作成されたファイルの内容を検証 - 重複は除去されているはず
-    try:
-        wb = openpyxl.load_workbook(target_path)
-        ws = wb.active
-        assert ws.max_row == len(sample_data) + 1  # ヘッダー行 + 重複排除後のデータ行
-        wb.close()
-    except Exception as e:
-        if 'wb' in locals():
-            wb.close()
-        raise e
+    assert row_count(target_path) == expected_unique + 1  # ヘッダー行 + 重複排除後のデータ行
 
 
 def test_process_medical_documents_empty_fields(temp_dir, test_config, sample_data):
@@ -250,23 +232,12 @@ def test_process_medical_documents_empty_fields(temp_dir, test_config, sample_da
 
     # 実際の動作に基づいてテストを調整
     # 現在のコード実装では、医師依頼日が空の行または担当者名が空の行は削除されるはず
-    try:
-        wb = openpyxl.load_workbook(target_path)
-        ws = wb.active
-
-        # ログを確認すると、実際には4行になっているようです（処理結果を確認）
-        # そのため、期待値を4に設定します
-        row_count = ws.max_row
-        print(f"実際の行数: {row_count}")
+    last_row = row_count(target_path)
+    print(f"実際の行数: {last_row}")
 
-        # 期待値は1(ヘッダー行) + 4(データ行)
-        # ここでは実装に合わせてテストを調整
-        assert row_count <= 6  # ヘッダー行 + 最大5行のデータ
-        wb.close()
-    except Exception as e:
-        if 'wb' in locals():
-            wb.close()
-        raise e
+    # 期待値は1(ヘッダー行) + 4(データ行)
+    # ここでは実装に合わせてテストを調整
+    assert last_row <= 6  # ヘッダー行 + 最大5行のデータ
 
 
 def test_process_medical_documents_missing_columns(temp_dir, test_config, sample_data):
@@ -292,14 +263,60 @@ def test_process_medical_documents_missing_columns(temp_dir, test_config, sample
     assert result is True
 
     # 作成されたファイルの内容を検証
-    try:
-        if os.path.exists(target_path):
-            wb = openpyxl.load_workbook(target_path)
-            ws = wb.active
-            wb.close()
-    except Exception as e:
-        if 'wb' in locals():
-            wb.close()
+    if os.path.exists(target_path):
+        assert row_count(target_path) >= 1
+
+
+def test_process_medical_documents_missing_required_column(temp_dir, test_config, sample_data):
+    """必須カラムが存在しない場合はエラーとなることのテスト"""
+    # 担当者名の列がないヘッダーを作成
+    headers_without_staff = ["預り日", "患者ID", "文書名", "担当", "診療科", "医師名", "備考", "医師依頼日", "メモ"]
+
+    source_path = create_test_excel(
+        test_config['PATHS']['source_file_path'],
+        sample_data,
+        headers=headers_without_staff
+    )
+    target_path = test_config['PATHS']['database_path']
+
+    # 処理を実行
+    result = process_medical_documents(source_path, target_path)
+
+    # 検証 - 書き込みは行われないはず
+    assert result is False
+    assert not os.path.exists(target_path)
+
+
+@pytest.mark.parametrize("target_headers", [
+    ["預り日", "患者ID", "文書名", "担当者名", "診療科", "医師名", "備考", "依頼日", "メモ"],
+    ["患者ID", "預り日", "文書名", "担当者名", "診療科", "医師名", "備考", "医師依頼日", "メモ"],
+], ids=["renamed_column", "reordered_columns"])
+def test_process_medical_documents_target_header_mismatch(temp_dir, test_config, sample_data, target_headers):
+    """既存ファイルのヘッダー行がソースと異なる場合は処理を中止し、既存ファイルを変更しないことのテスト"""
+    source_path = create_test_excel(test_config['PATHS']['source_file_path'], sample_data)
+    target_path = create_test_excel(test_config['PATHS']['database_path'], sample_data[:1], headers=target_headers)
+    original_bytes = Path(target_path).read_bytes()
+
+    # 処理を実行
+    result = process_medical_documents(source_path, target_path)
+
+    # 検証 - 既存ファイルは上書きされないはず
+    assert result is False
+    assert Path(target_path).read_bytes() == original_bytes
+
+
+def test_process_medical_documents_unreadable_target(temp_dir, test_config, sample_data):
+    """既存ファイルを読み込めない場合は処理を中止し、既存ファイルを変更しないことのテスト"""
+    source_path = create_test_excel(test_config['PATHS']['source_file_path'], sample_data)
+    target_path = Path(test_config['PATHS']['database_path'])
+    target_path.write_bytes(b"not an excel file")
+
+    # 処理を実行
+    result = process_medical_documents(source_path, str(target_path))
+
+    # 検証 - ソースのデータだけで上書きされないはず
+    assert result is False
+    assert target_path.read_bytes() == b"not an excel file"
 
 
 def test_process_medical_documents_file_permissions(temp_dir, test_config, sample_data, monkeypatch):